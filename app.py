@@ -1,16 +1,27 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_from_directory, send_file, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from uuid import uuid4
 from datetime import datetime
-import json, os, difflib, time
+import json, os, difflib, time, re
+import threading, queue, atexit
+from concurrent.futures import Future
 import random
 from pathlib import Path
-from filelock import FileLock
+from filelock import FileLock, Timeout
 from apscheduler.schedulers.background import BackgroundScheduler
 import shutil
-from collections import defaultdict
-from jsonlines import open as jsonl_open
-from datetime import datetime, timedelta
+from collections import deque
+from storage import Store, write_atomic
+from corpus import CorpusWriter, open_dump
+from tailreader import JsonlFollower
+from ratelimit import RateLimiter, retry_after
+from rollups import ActivityRollups, GRANULARITIES
+from billing import BillingCache, build_statements, is_closed, ledger_rows, ledger_text
+from tiering import TieredOutputs, BlockArchive, demote_file, chunked, HOT_DAYS
+from array import array
+from bisect import bisect_left
+from prompt_templates import PROMPT_TEMPLATES, load_templates, template_for, render_prompt
+from datetime import date, datetime, timedelta
 
 
 
@@ -19,96 +30,408 @@ app.secret_key = 'supersecretkey'
 
 # === Constants ===
 USERS_FILE = 'users.json'
-PERSIST_DIR = '/var/data'
+PERSIST_DIR = os.environ.get('PERSIST_DIR', '/var/data')
 INPUT_FILE = os.path.join(PERSIST_DIR, 'inputs', 'arxiv_2000_2025_all_final.jsonl')
 RESPONSES_DIR = os.path.join(PERSIST_DIR, 'responses')
 OUTPUT_DIR = os.path.join(PERSIST_DIR, 'outputs')
 PROGRESS_DIR = os.path.join(PERSIST_DIR, 'progress')
 USER_LOG_DIR = os.path.join(PERSIST_DIR, 'user_logs')
 TIMEOUT_SECONDS = 900  # 15 minutes
+PROMPT_TEMPLATES_FILE = os.path.join(PERSIST_DIR, 'prompt_templates.json')
+STORE_DIR = os.path.join(PERSIST_DIR, 'store')
+UPLOAD_DIR = os.path.join(PERSIST_DIR, 'inputs', 'uploads')
+BILLING_DIR = os.path.join(PERSIST_DIR, 'billing')
 MODELS = ["gemini_flash", "grok", "chatgpt_4o_mini", "claude", "copilot"]
+MAX_ACTIVITY_BUCKETS = 1000  # points per admin activity chart
+BUCKETS_PER_DAY = {"hour": 24, "day": 1, "week": 1 / 7}
 
 # === Ensure directories ===
-for path in [RESPONSES_DIR, OUTPUT_DIR, PROGRESS_DIR, USER_LOG_DIR, os.path.dirname(INPUT_FILE)]:
+for path in [RESPONSES_DIR, OUTPUT_DIR, PROGRESS_DIR, USER_LOG_DIR, os.path.dirname(INPUT_FILE), UPLOAD_DIR]:
     os.makedirs(path, exist_ok=True)
 
-# === Load Users ===
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, 'w') as f:
-        json.dump({}, f)
-
-with open(USERS_FILE, 'r+') as f:
-    users = json.load(f)
-    if 'admin' not in users:
-        users['admin'] = {
-            'password': generate_password_hash("testgptmodels"),
-            'email': 'admin@example.com',
-            'phone': '0000000000'
-        }
-        f.seek(0)
-        json.dump(users, f, indent=2)
-        f.truncate()
+# === Prompt Templates ===
+load_templates(PROMPT_TEMPLATES_FILE)
 
-# === Prompt Allocation with Expiry Check ===
-def get_next_prompt(model, username):
-    user_log_file = os.path.join(USER_LOG_DIR, f"{model}_users.jsonl")
-    assigned_ids = set()
-    active_assignments = {}
-    now = int(time.time())
+# === Store ===
+outputs = TieredOutputs(OUTPUT_DIR)
+
+
+def load_legacy_state():
+    """Rows for seeding an empty store from users.json, user_logs/ and outputs/."""
+    users = []
+    if os.path.exists(USERS_FILE):
+        with open(USERS_FILE, 'r') as f:
+            for username, info in json.load(f).items():
+                users.append(dict(info, username=username))
 
-    # Track submitted and recently assigned prompt IDs
-    if os.path.exists(user_log_file):
+    assignments = {}
+    for model in MODELS:
+        user_log_file = os.path.join(USER_LOG_DIR, f"{model}_users.jsonl")
+        if not os.path.exists(user_log_file):
+            continue
         with open(user_log_file, 'r') as f:
             for line in f:
                 entry = json.loads(line)
-                prompt_id = str(entry["id"])
-                if entry.get("submitted"):
-                    assigned_ids.add(prompt_id)  # Already submitted
-                elif now - entry.get("assigned_at", 0) < TIMEOUT_SECONDS:
-                    assigned_ids.add(prompt_id)  # Still within timeout
-                    active_assignments[prompt_id] = entry
-
-    completed = len([
-        1 for v in active_assignments.values()
-        if v.get("submitted")
-    ])
-
-    # Find the next unassigned prompt
-    with jsonl_open(INPUT_FILE) as reader:
-        for idx, obj in enumerate(reader):
-            prompt_id = str(obj.get("id") or idx)
-            if prompt_id not in assigned_ids:
-                timestamp = int(time.time())
-                log_entry = {
-                    "username": username,
-                    "model": model,
-                    "id": prompt_id,
-                    "assigned_at": timestamp,
-                    "submitted": False
-                }
-                with open(user_log_file, 'a') as log:
-                    log.write(json.dumps(log_entry) + "\n")
-
-                obj["id"] = prompt_id
-                obj["prompt"] = (
-                    f'Prompt Template: Generate a academic abstract of 150 to 300 words on the topic "{obj["title"]}". '
-                    'Use a formal academic tone emphasizing clarity, objectivity, and technical accuracy. '
-                    'Avoid suggestions, conversational language, and introductory framing. The response should contain all the below mention '
-                    '{"model name":"<GPT model name - the name of the AI model generating the response>", '
-                    '"Core_Model":"<core GPT model name - name of the core language model used>", '
-                    '"Title":"<title content>", '
-                    '"Abstract":"<abstract content - should match the title!>", '
-                    '"Keywords":"<comma-separated keywords - should match the domain of the abstract>", '
-                    '"think":"should reflect reasoning behind abstract generation", '
-                    '"word_count": word count of abstract, '
-                    '"sentence_count": Sentence count of abstract, '
-                    '"character_count": character count of abstract, '
-                    '"generated_at":"Timestamp"} '
-                    'Use valid JSON format.'
-                )
-                return obj
-
-    return {"title": None, "prompt": None}
+                entry["id"] = str(entry["id"])
+                key = (model, entry["id"])
+                current = assignments.get(key)
+                if current is None or (not current.get("submitted") and (
+                        entry.get("submitted") or entry.get("assigned_at", 0) >= current.get("assigned_at", 0))):
+                    assignments[key] = dict(entry, model=model, submitted=bool(entry.get("submitted")),
+                                            assigned_at=entry.get("assigned_at", 0))
+
+    submissions = []
+    for model in MODELS:
+        for entry in outputs.iter_records(model):
+            entry["id"] = str(entry["id"])
+            entry["model"] = model
+            submissions.append(entry)
+            assignments[(model, entry["id"])] = {
+                "model": model, "id": entry["id"], "username": entry["username"],
+                "assigned_at": assignments.get((model, entry["id"]), {}).get("assigned_at", 0),
+                "submitted": True
+            }
+    return users, list(assignments.values()), submissions
+
+
+store = Store(STORE_DIR, seed=load_legacy_state)
+rollups = ActivityRollups()
+store.subscribe(rollups)
+
+store.add_user({
+    'username': 'admin',
+    'password': generate_password_hash("testgptmodels"),
+    'email': 'admin@example.com',
+    'phone': '0000000000'
+})
+
+# === Prompt Allocation with Expiry Check ===
+class CorpusIndex:
+    """Prompt ids in input-file order with the byte offset of each line, fed
+    incrementally so new prompts are picked up without re-reading the file.
+    Ids are packed integers to keep multi-million-line corpora small; lines
+    without one are skipped, since a positional fallback could collide with
+    real ids and corpus.py assigns ids to everything it ingests. Skipped
+    lines are counted so reserve_prompts can report them.
+
+    corpus.py hands out increasing ids, so ids are looked up by bisection;
+    an id→position dict is built only for corpora that aren't in id order."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.ids = array('q')
+        self.offsets = array('q')
+        self.skipped = 0  # lines fed since last reported that had no integer id
+        self.ordered = True
+        self.positions = {}  # id -> position, only filled when not ordered
+        self.cursors = {}  # model -> position before which every prompt is submitted
+
+    def feed(self, record, offset):
+        if not isinstance(record.get("id"), int):
+            self.skipped += 1
+            return
+        if self.ids and record["id"] <= self.ids[-1]:
+            self.ordered = False
+        self.ids.append(record["id"])
+        self.offsets.append(offset)
+
+    def position(self, prompt_id):
+        try:
+            prompt_id = int(prompt_id)
+        except ValueError:
+            return None
+        if self.ordered:
+            i = bisect_left(self.ids, prompt_id)
+            return i if i < len(self.ids) and self.ids[i] == prompt_id else None
+        for i in range(len(self.positions), len(self.ids)):
+            self.positions.setdefault(self.ids[i], i)
+        return self.positions.get(prompt_id)
+
+    def load(self, positions):
+        """Prompt objects (with string ids) for the given positions, in one file open."""
+        objs = []
+        with open(INPUT_FILE, 'rb') as f:
+            for position in positions:
+                f.seek(self.offsets[position])
+                obj = json.loads(f.readline())
+                obj["id"] = str(self.ids[position])
+                objs.append(obj)
+        return objs
+
+    def find(self, prompt_id):
+        position = self.position(prompt_id)
+        return None if position is None else self.load([position])[0]
+
+
+corpus = CorpusIndex()
+corpus_follower = JsonlFollower(INPUT_FILE, corpus)
+
+
+def reserve_prompts(model, count, now):
+    """Reserve up to `count` unclaimed prompts for this worker. Caller must hold
+    the store lock."""
+    corpus_follower.refresh()
+    if corpus.skipped:
+        app.logger.warning("%d lines in %s have no integer id and will never be handed out",
+                           corpus.skipped, INPUT_FILE)
+        corpus.skipped = 0
+
+    # Prompts are claimed roughly in corpus order, so everything before the
+    # cursor is submitted and scans start there instead of at position 0
+    ids = corpus.ids
+    position = corpus.cursors.get(model, 0)
+    while position < len(ids):
+        row = store.assignments.get(f"{model}:{ids[position]}")
+        if not (row and row["submitted"]):
+            break
+        position += 1
+    corpus.cursors[model] = position
+
+    free = []
+    while position < len(ids) and len(free) < count:
+        row = store.assignments.get(f"{model}:{ids[position]}")
+        if row is None or (not row["submitted"] and now - row["assigned_at"] >= TIMEOUT_SECONDS):
+            free.append(position)
+        position += 1
+    reserved = corpus.load(free)
+
+    # Reservations are ordinary unsubmitted leases, so other workers skip them
+    # and they free themselves after TIMEOUT_SECONDS if this worker dies
+    store.lease([{
+        "username": RESERVED_BY,
+        "model": model,
+        "id": obj["id"],
+        "assigned_at": now,
+        "submitted": False,
+        "worker": os.getpid()
+    } for obj in reserved])
+    return reserved
+
+
+# === Claim Dispatcher ===
+# Every get_next for a model goes through one in-process queue drained by a
+# single thread. It keeps a small buffer of prompts already reserved in the
+# store, so the common path hands one out from memory; the leases it hands out
+# are written to the store in batches.
+RESERVED_BY = "__reserved__"
+CLAIM_BUFFER = 8
+FLUSH_INTERVAL = 1.0  # seconds
+FLUSH_BATCH = 32
+
+
+class ClaimDispatcher:
+    def __init__(self, model):
+        self.model = model
+        self.requests = queue.Queue()
+        self.ready = deque()  # (reserved_at, prompt obj)
+        self.pending = []  # leases not yet written to the store
+        self.handed_out = {}  # prompt id -> (assigned_at, prompt obj), to hand back without a corpus read
+        self.pending_lock = threading.Lock()
+        self.last_flush = time.time()
+        threading.Thread(target=self._run, name=f"claims-{model}", daemon=True).start()
+
+    def claim(self, username, timeout=30):
+        waiter = Future()
+        self.requests.put((username, waiter))
+        return waiter.result(timeout)
+
+    def flush(self):
+        with self.pending_lock:
+            store.lease(self.pending)
+            self.pending = []
+            self.last_flush = time.time()
+
+    def open_lease(self, username, now):
+        """(lease, prompt obj) for the user's newest unsubmitted, unexpired lease
+        on this model, or (None, None). Reads memory only; _dispatch catches the
+        store up once per batch."""
+        with self.pending_lock:
+            candidates = [e for e in self.pending if e["username"] == username]
+        with store.mutex:
+            candidates += [e for e in store.assignments.where('username', username)
+                           if e["model"] == self.model and not e["submitted"]]
+            for lease in sorted(candidates, key=lambda e: e["assigned_at"], reverse=True):
+                if now - lease["assigned_at"] >= TIMEOUT_SECONDS:
+                    continue
+                # A pending lease may since have been submitted, or expired and reassigned
+                stored = store.assignments.get(f"{self.model}:{lease['id']}")
+                if stored and (stored["submitted"] or stored["username"] not in (username, RESERVED_BY)):
+                    continue
+                cached = self.handed_out.get(lease["id"])
+                obj = cached[1] if cached else corpus.find(lease["id"])
+                if obj is not None:
+                    return lease, obj
+        return None, None
+
+    def pending_lease(self, username, prompt_id):
+        with self.pending_lock:
+            for lease in reversed(self.pending):
+                if lease["username"] == username and lease["id"] == prompt_id:
+                    return lease
+        return None
+
+    def _refill(self, now, wanted):
+        with self.pending_lock, store.locked():
+            # Leases handed out so far must be stored before the next scan
+            store.lease(self.pending)
+            self.pending = []
+            self.last_flush = time.time()
+            for obj in reserve_prompts(self.model, wanted, now):
+                self.ready.append((now, obj))
+        self.handed_out = {k: v for k, v in self.handed_out.items() if now - v[0] < TIMEOUT_SECONDS}
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self.requests.get(timeout=FLUSH_INTERVAL)]
+            except queue.Empty:
+                self.flush()
+                continue
+            while True:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._dispatch(batch)
+            except Exception as e:
+                for _, waiter in batch:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+
+    def _dispatch(self, batch):
+        now = int(time.time())
+        store.catch_up()
+        # Reloading the page or switching models back hands out the same task
+        # again (with a fresh expiry) rather than leasing another one
+        handed = {}  # username -> (lease, obj) given out in this batch
+        for username, _ in batch:
+            if username not in handed:
+                lease, obj = self.open_lease(username, now)
+                if lease is not None:
+                    template = lease.get("template_version") or template_for(self.model)
+                    handed[username] = (dict(lease, template_version=template), obj)
+        wanted = len({username for username, _ in batch} - set(handed))
+
+        # Drop reservations old enough that they may expire before submission
+        while self.ready and now - self.ready[0][0] > TIMEOUT_SECONDS // 2:
+            self.ready.popleft()
+        if len(self.ready) < wanted:
+            self._refill(now, wanted - len(self.ready) + CLAIM_BUFFER)
+
+        leases = []
+        template = template_for(self.model)
+        for username, waiter in batch:
+            if username in handed:
+                lease, obj = handed[username]
+                if lease["assigned_at"] != now:
+                    lease = dict(lease, assigned_at=now)
+                    leases.append(lease)
+                    handed[username] = (lease, obj)
+                    self.handed_out[obj["id"]] = (now, obj)
+                waiter.set_result({"id": obj["id"], "title": obj["title"], "template": lease["template_version"]})
+                continue
+            if not self.ready:
+                waiter.set_result({"id": None, "title": None, "template": None})
+                continue
+            _, obj = self.ready.popleft()
+            lease = {
+                "username": username,
+                "model": self.model,
+                "id": obj["id"],
+                "assigned_at": now,
+                "submitted": False,
+                "template_version": template
+            }
+            leases.append(lease)
+            handed[username] = (lease, obj)
+            self.handed_out[obj["id"]] = (now, obj)
+            waiter.set_result({"id": obj["id"], "title": obj["title"], "template": template})
+
+        with self.pending_lock:
+            self.pending.extend(leases)
+            due = len(self.pending) >= FLUSH_BATCH or time.time() - self.last_flush >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_dispatcher(model):
+    with _dispatchers_lock:
+        if model not in _dispatchers:
+            _dispatchers[model] = ClaimDispatcher(model)
+        return _dispatchers[model]
+
+
+def flush_all_claims():
+    for dispatcher in list(_dispatchers.values()):
+        dispatcher.flush()
+
+
+atexit.register(flush_all_claims)
+
+
+def get_next_prompt(model, username):
+    return get_dispatcher(model).claim(username)
+
+
+def leased_template(model, prompt_id, username):
+    """Template version the prompt was handed out with, or None if this user
+    holds no lease on it (e.g. it expired and was reassigned)."""
+    lease = get_dispatcher(model).pending_lease(username, prompt_id) or store.get_lease(model, prompt_id)
+    if lease and lease["username"] == username:
+        return lease["template_version"]
+    return None
+
+
+# === Rate Limiting and Backpressure ===
+RATE_LIMITING = os.environ.get('RATE_LIMITING', '1') != '0'  # benchmarks turn it off
+# Buckets are (key, capacity, tokens per second)
+GET_NEXT_PER_USER = (20, 0.5)
+GET_NEXT_PER_MODEL = (200, 20.0)
+SUBMIT_PER_USER = (10, 0.2)
+SUBMIT_PER_MODEL = (200, 20.0)
+MAX_QUEUED_CLAIMS = 64  # per model dispatcher
+MAX_QUEUED_WRITES = 32  # store writes waiting on the lock in this worker
+
+rate_limiter = RateLimiter(os.environ.get('RATE_LIMIT_DB'))
+
+
+def too_many_requests(message, seconds, **body):
+    response = jsonify(dict(body, message=message, retry_after=int(retry_after(seconds))))
+    response.status_code = 429
+    response.headers['Retry-After'] = retry_after(seconds)
+    return response
+
+
+def throttle_get_next(model, username):
+    """A 429 response if this claim should be refused, else None."""
+    if not RATE_LIMITING:
+        return None
+    if get_dispatcher(model).requests.qsize() >= MAX_QUEUED_CLAIMS or store.waiting_writers >= MAX_QUEUED_WRITES:
+        return too_many_requests("Server busy, please retry", FLUSH_INTERVAL, error="Busy")
+    wait = rate_limiter.take((f"get_next:user:{username}", *GET_NEXT_PER_USER),
+                             (f"get_next:model:{model}", *GET_NEXT_PER_MODEL))
+    if wait:
+        return too_many_requests("Too many requests", wait, error="Rate limited")
+    return None
+
+
+def throttle_submit(model, username):
+    if not RATE_LIMITING:
+        return None
+    if store.waiting_writers >= MAX_QUEUED_WRITES:
+        return too_many_requests("Server busy, please retry", 1, status='error')
+    wait = rate_limiter.take((f"submit:user:{username}", *SUBMIT_PER_USER),
+                             (f"submit:model:{model}", *SUBMIT_PER_MODEL))
+    if wait:
+        return too_many_requests("Too many submissions", wait, status='error')
+    return None
 
 
 
@@ -116,27 +439,135 @@ def get_next_prompt(model, username):
 def get_next(model):
     if 'username' not in session:
         return jsonify({"error": "Unauthorized"}), 401
-    return jsonify(get_next_prompt(model, session['username']))
+    if model not in MODELS:
+        return jsonify({"error": "Unknown model"}), 404
+    username = session['username']
+
+    throttled = throttle_get_next(model, username)
+    if throttled:
+        return throttled
+
+    task = get_next_prompt(model, username)
+    # Browsers render the cached template themselves; scripts may ask for the text
+    if request.args.get('full') and task["title"]:
+        task["prompt"] = render_prompt(task["template"], task["id"], task["title"])
+    return jsonify(task)
+
+
+@app.route('/prompt_template/<version>')
+def prompt_template(version):
+    if 'username' not in session:
+        return jsonify({"error": "Unauthorized"}), 401
+    if version not in PROMPT_TEMPLATES:
+        return jsonify({"error": "Unknown template"}), 404
+    response = jsonify({"version": version, "template": PROMPT_TEMPLATES[version]})
+    # Published versions never change
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+# === Corpus Upload ===
+def corpus_job_file(job):
+    return os.path.join(UPLOAD_DIR, f"{job}.json")
+
+
+def run_ingest_job(job, path):
+    status = {"job": job, "status": "running"}
+    write_atomic(corpus_job_file(job), json.dumps(status))
+    writer = None
+    try:
+        writer = CorpusWriter(INPUT_FILE)
+        with open_dump(path) as dump:
+            status.update(writer.ingest(dump), status="done")
+    except Exception as e:
+        status.update(status="failed", error=str(e))
+    finally:
+        if writer is not None:
+            writer.close()
+        os.remove(path)
+    write_atomic(corpus_job_file(job), json.dumps(status))
+
+
+@app.route('/admin/corpus/upload', methods=['POST'])
+def upload_corpus():
+    if session.get('username') != 'admin':
+        return jsonify({"error": "Forbidden"}), 403
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({"error": "No file uploaded"}), 400
+
+    job = uuid4().hex
+    path = os.path.join(UPLOAD_DIR, f"{job}.jsonl.gz" if upload.filename.endswith('.gz') else f"{job}.jsonl")
+    upload.save(path)
+    # Large dumps take longer than a request may, so ingest in the background
+    threading.Thread(target=run_ingest_job, args=(job, path), name=f"ingest-{job}", daemon=True).start()
+    return jsonify({"job": job, "status": "running"}), 202
+
+
+@app.route('/admin/corpus/jobs/<job>')
+def corpus_job(job):
+    if session.get('username') != 'admin':
+        return jsonify({"error": "Forbidden"}), 403
+    if not re.fullmatch(r'[0-9a-f]{32}', job) or not os.path.exists(corpus_job_file(job)):
+        return jsonify({"error": "Unknown job"}), 404
+    with open(corpus_job_file(job), 'r') as f:
+        return jsonify(json.load(f))
+
 
 # === Reassignment Logic ===
 def reassign_expired_prompts():
-    now = int(time.time())
+    store.expire(int(time.time()) - TIMEOUT_SECONDS)
+
+
+# === Checkpoint and Exports ===
+# The JSONL files under outputs/ and user_logs/ and users.json are exports of
+# the store, refreshed on every checkpoint.
+def demote_cold_outputs():
+    """Move output records older than HOT_DAYS into the compressed archive tier.
+    Runs under the store lock, right after a checkpoint has exported everything,
+    so the export's dedupe against the hot file's last uuid stays correct."""
+    cutoff = (datetime.utcnow() - timedelta(days=HOT_DAYS)).isoformat()
     for model in MODELS:
-        user_log_file = os.path.join(USER_LOG_DIR, f"{model}_users.jsonl")
-        if not os.path.exists(user_log_file):
-            continue
-        valid_entries = []
-        with open(user_log_file, 'r') as f:
-            for line in f:
-                entry = json.loads(line)
-                if entry.get("submitted") or now - entry.get("assigned_at", 0) <= TIMEOUT_SECONDS:
-                    valid_entries.append(entry)
-        with open(user_log_file, 'w') as f:
-            for entry in valid_entries:
-                f.write(json.dumps(entry) + '\n')
+        outputs.demote(model, cutoff)
+
+
+def archive_legacy_responses():
+    # responses/ was a second uncompressed copy of outputs/ and is no longer
+    # written; compress whatever is left of it, every record regardless of age
+    for model in MODELS:
+        path = os.path.join(RESPONSES_DIR, f"{model}.jsonl")
+        if os.path.exists(path) and os.path.getsize(path):
+            archive = BlockArchive(os.path.join(RESPONSES_DIR, f"{model}.archive.jsonl.gz"))
+            demote_file(path, archive, cutoff="\uffff", min_records=1)
+
+
+# Every worker's scheduler fires the checkpoint; one worker runs it at a time
+# and the rest skip, and a checkpoint with nothing new in the WAL is a no-op
+checkpoint_lock = FileLock(os.path.join(STORE_DIR, 'checkpoint.lock'))
+
+
+def checkpoint_store():
+    flush_all_claims()
+    try:
+        checkpoint_lock.acquire(blocking=False)
+    except Timeout:
+        return
+    try:
+        with store.locked():
+            if not store.checkpoint(OUTPUT_DIR):
+                return
+            demote_cold_outputs()
+            archive_legacy_responses()
+        store.export_user_logs(USER_LOG_DIR, MODELS, exclude=(RESERVED_BY,))
+        store.export_users(USERS_FILE)
+    finally:
+        checkpoint_lock.release()
+
+
+atexit.register(checkpoint_store)
 
 scheduler = BackgroundScheduler()
 scheduler.add_job(reassign_expired_prompts, 'interval', minutes=5)
+scheduler.add_job(checkpoint_store, 'interval', minutes=5)
 scheduler.start()
 
 # === Submit Route ===
@@ -144,12 +575,21 @@ scheduler.start()
 def submit_response(model):
     if 'username' not in session:
         return jsonify({'status': 'error', 'message': 'Not logged in'})
+    if model not in MODELS:
+        return jsonify({'status': 'error', 'message': 'Unknown model'}), 404
 
     data = request.get_json()
     username = session['username']
+
+    throttled = throttle_submit(model, username)
+    if throttled:
+        return throttled
     response = data.get('response', '').strip()
     title = data.get('title', '').strip()
     prompt_id = str(data.get('id'))
+    # Recorded from the lease, not the client, so a default changing while
+    # the task is open doesn't mislabel the response
+    template_version = leased_template(model, prompt_id, username)
 
     if len(response.split()) < 50:
         return jsonify({'status': 'error', 'message': 'Response must be at least 50 words'})
@@ -168,25 +608,12 @@ def submit_response(model):
         'word_count': word_count,
         'sentence_count': sentence_count,
         'character_count': char_count,
+        'template_version': template_version,
         'timestamp': datetime.utcnow().isoformat()
     }
 
-    with open(os.path.join(RESPONSES_DIR, f"{model}.jsonl"), 'a', encoding='utf-8') as f:
-        f.write(json.dumps(entry) + '\n')
-    with open(os.path.join(OUTPUT_DIR, f"output_{model}.jsonl"), 'a', encoding='utf-8') as f:
-        f.write(json.dumps(entry) + '\n')
-
-    user_log_file = os.path.join(USER_LOG_DIR, f"{model}_users.jsonl")
-    updated = []
-    with open(user_log_file, 'r') as f:
-        for line in f:
-            e = json.loads(line)
-            if e['id'] == prompt_id and e['username'] == username:
-                e['submitted'] = True
-            updated.append(e)
-    with open(user_log_file, 'w') as f:
-        for e in updated:
-            f.write(json.dumps(e) + '\n')
+    # One WAL record covers both the response and marking the prompt submitted
+    store.submit(entry)
 
     return jsonify({'status': 'success'})
 
@@ -209,19 +636,15 @@ def register():
             flash("Passwords do not match")
             return redirect(url_for('register'))
 
-        with open(USERS_FILE, 'r+') as f:
-            users = json.load(f)
-            if username in users:
-                flash("Username already exists")
-                return redirect(url_for('register'))
-            users[username] = {
-                'password': generate_password_hash(password),
-                'email': email,
-                'phone': phone
-            }
-            f.seek(0)
-            json.dump(users, f, indent=2)
-            f.truncate()
+        added = store.add_user({
+            'username': username,
+            'password': generate_password_hash(password),
+            'email': email,
+            'phone': phone
+        })
+        if not added:
+            flash("Username already exists")
+            return redirect(url_for('register'))
 
         flash("Registration successful")
         return redirect(url_for('home'))
@@ -232,9 +655,8 @@ def register():
 def login():
     username = request.form['username']
     password = request.form['password']
-    with open(USERS_FILE) as f:
-        users = json.load(f)
-    if username in users and check_password_hash(users[username]['password'], password):
+    user = store.get_user(username)
+    if user and check_password_hash(user['password'], password):
         session['username'] = username
         return redirect(url_for('admin_dashboard') if username == 'admin' else url_for('submit'))
     flash("Invalid credentials")
@@ -258,20 +680,8 @@ def user_dashboard():
         return redirect(url_for('login'))
 
     username = session['username']
-    user_responses = []
-
-    for model in MODELS:
-        path = os.path.join(OUTPUT_DIR, f'output_{model}.jsonl')
-        if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data = json.loads(line)
-                    if data.get('username') == username:
-                        user_responses.append((model, data))
-
-    model_counter = {m: 0 for m in MODELS}
-    for model, _ in user_responses:
-        model_counter[model] += 1
+    store.catch_up()
+    model_counter = {m: rollups.totals.get(username, {}).get(m, 0) for m in MODELS}
 
     model_counts = [{'name': m.replace('_', ' ').title(), 'count': model_counter[m]} for m in MODELS]
 
@@ -279,84 +689,56 @@ def user_dashboard():
 
 
 # Define the helper function at global scope
-def compute_top_contributors():
-    user_data = {}
-
-    for model in MODELS:
-        output_file = os.path.join(OUTPUT_DIR, f"output_{model}.jsonl")
-        if not os.path.exists(output_file):
-            continue
-        with open(output_file, "r", encoding="utf-8") as f:
-            for line in f:
-                entry = json.loads(line)
-                username = entry.get("username", "unknown")
-                if username not in user_data:
-                    user_data[username] = {m: 0 for m in MODELS}
-                    user_data[username]["total"] = 0
-                user_data[username][model] += 1
-                user_data[username]["total"] += 1
-
+def compute_top_contributors(n=None, start=None, end=None, granularity="day"):
+    store.catch_up()
     contributors = []
-    for user, counts in user_data.items():
+    for username, counts, total in rollups.top_contributors(n, start, end, granularity):
         contributors.append({
-            "username": user,
-            "total": counts["total"],
-            "gemini_flash": counts["gemini_flash"],
-            "grok": counts["grok"],
-            "chatgpt_4o_mini": counts["chatgpt_4o_mini"],
-            "claude": counts["claude"],
-            "copilot": counts["copilot"]
+            "username": username,
+            "total": total,
+            "gemini_flash": counts.get("gemini_flash", 0),
+            "grok": counts.get("grok", 0),
+            "chatgpt_4o_mini": counts.get("chatgpt_4o_mini", 0),
+            "claude": counts.get("claude", 0),
+            "copilot": counts.get("copilot", 0)
         })
-
-    contributors.sort(key=lambda x: x["total"], reverse=True)
     return contributors
 
 
-from collections import defaultdict
-from datetime import datetime, timedelta
+def parse_activity_range(args):
+    """(start, end, granularity) from the dashboard query string; defaults to the last 15 days."""
+    today = datetime.utcnow().date()
+    try:
+        end = date.fromisoformat(args.get("end") or today.isoformat())
+        start = date.fromisoformat(args.get("start") or (end - timedelta(days=14)).isoformat())
+    except ValueError:
+        start, end = today - timedelta(days=14), today
+    if start > end:
+        start, end = end, start
+    granularity = args.get("granularity", "day")
+    if granularity not in GRANULARITIES:
+        granularity = "day"
+    # Coarsen rather than draw thousands of points
+    days = (end - start).days + 1
+    while granularity != "week" and days * BUCKETS_PER_DAY[granularity] > MAX_ACTIVITY_BUCKETS:
+        granularity = GRANULARITIES[GRANULARITIES.index(granularity) + 1]
+    # Weeks can't coarsen further, so longer ranges keep only the latest weeks
+    if days > (MAX_ACTIVITY_BUCKETS - 1) * 7:
+        start = end - timedelta(weeks=MAX_ACTIVITY_BUCKETS - 1)
+    return start, end, granularity
+
 
 @app.route("/admin_dashboard")
 def admin_dashboard():
     if "username" not in session or session["username"] != "admin":
         return redirect(url_for("login"))
 
-    def compute_top_contributors():
-        user_data = {}
-        for model in MODELS:
-            output_file = os.path.join(OUTPUT_DIR, f"output_{model}.jsonl")
-            if not os.path.exists(output_file):
-                continue
-            with open(output_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    entry = json.loads(line)
-                    username = entry.get("username", "unknown")
-                    if username not in user_data:
-                        user_data[username] = {m: 0 for m in MODELS}
-                        user_data[username]["total"] = 0
-                    user_data[username][model] += 1
-                    user_data[username]["total"] += 1
-
-        contributors = []
-        for user, counts in user_data.items():
-            contributors.append({
-                "username": user,
-                "total": counts["total"],
-                "gemini_flash": counts["gemini_flash"],
-                "grok": counts["grok"],
-                "chatgpt_4o_mini": counts["chatgpt_4o_mini"],
-                "claude": counts["claude"],
-                "copilot": counts["copilot"]
-            })
-
-        contributors.sort(key=lambda x: x["total"], reverse=True)
-        return contributors
-
     top_contributors = compute_top_contributors()
 
     total_answers = {
         "labels": ["Gemini Flash", "Grok", "ChatGPT 4o Mini", "Claude", "Microsoft Copilot"],
         "counts": [
-            sum(1 for _ in open(os.path.join(OUTPUT_DIR, f"output_{model}.jsonl"), encoding="utf-8")) if os.path.exists(os.path.join(OUTPUT_DIR, f"output_{model}.jsonl")) else 0
+            sum(user[model] for user in top_contributors)
             for model in MODELS
         ]
     }
@@ -372,34 +754,25 @@ def admin_dashboard():
         ]
     }
 
-    # ✅ Generate REAL Daily User Activity (last 15 days)
-    date_format = "%Y-%m-%d"
-    today = datetime.now().date()
-    dates = [(today - timedelta(days=i)).strftime(date_format) for i in reversed(range(15))]
-
-    user_counts_by_day = defaultdict(lambda: defaultdict(int))
-    for model in MODELS:
-        output_file = os.path.join(OUTPUT_DIR, f"output_{model}.jsonl")
-        if os.path.exists(output_file):
-            with open(output_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    entry = json.loads(line)
-                    username = entry.get("username", "unknown")
-                    timestamp = entry.get("timestamp")
-                    if timestamp:
-                        date_str = timestamp.split("T")[0]
-                        if date_str in dates:
-                            user_counts_by_day[username][date_str] += 1
+    # ✅ User Activity for the requested range, served from the rollups
+    start, end, granularity = parse_activity_range(request.args)
+    top_n = min(max(request.args.get("top", 4, type=int), 1), 20)
+    labels, series = rollups.activity(start, end, granularity)
+    ranked = compute_top_contributors(top_n, start, end, granularity)
 
     daily_user_activity = {
-        "dates": dates,
+        "dates": labels,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "granularity": granularity,
+        "top": top_n,
         "users": [
             {
-                "username": username,
-                "counts": [user_counts_by_day[username][d] for d in dates],
+                "username": user["username"],
+                "counts": series.get(user["username"], [0] * len(labels)),
                 "color": f"hsl({(i*45)%360}, 60%, 50%)"
             }
-            for i, username in enumerate(list(user_counts_by_day.keys())[:4])
+            for i, user in enumerate(ranked)
         ]
     }
 
@@ -411,44 +784,14 @@ def admin_dashboard():
     )
 
 
-@app.route("/receipt/<username>")
-def receipt(username):
-    base_price_per_submission = 0.10
-    additional_charges = 0.0
-
-    # Load user details from users.json
-    with open(USERS_FILE, 'r') as f:
-        users = json.load(f)
-    user_info = users.get(username, {})
-    to_phone = user_info.get("phone", "N/A")
-    to_email = user_info.get("email", f"{username}@gmail.com")
-
-    # Collect submission data
-    items = []
-    total_submitted = 0
+# === Billing ===
+billing_cache = BillingCache(BILLING_DIR)
 
-    for model in MODELS:
-        file_path = os.path.join(OUTPUT_DIR, f"output_{model}.jsonl")
-        if not os.path.exists(file_path):
-            continue
-        with open(file_path, "r", encoding="utf-8") as f:
-            count = 0
-            for line in f:
-                entry = json.loads(line)
-                if entry.get("username") == username:
-                    count += 1
-            if count > 0:
-                items.append({
-                    "description": f"{model.replace('_', ' ').title()} Abstracts",
-                    "quantity": count,
-                    "price": base_price_per_submission,
-                    "amount": base_price_per_submission * count
-                })
-                total_submitted += count
-
-    amount = sum(item["amount"] for item in items)
-    total = amount + additional_charges
 
+def render_statement(statement):
+    username = statement["username"]
+    user_info = store.get_user(username) or {}
+    additional_charges = 0.0
     return render_template("receipt.html",
         receipt_number=f"R-{datetime.now().strftime('%Y%m%d%H%M%S')}",
         receipt_date=datetime.now().strftime("%Y-%m-%d"),
@@ -456,22 +799,121 @@ def receipt(username):
         from_phone="8660946035",
         from_email="testgptmodels@gmail.com",
         to_name=username,
-        to_phone=to_phone,
-        to_email=to_email,
-        items=items,
-        amount=amount,
+        to_phone=user_info.get("phone", "N/A"),
+        to_email=user_info.get("email", f"{username}@gmail.com"),
+        items=statement["items"],
+        amount=statement["amount"],
         additional_charges=additional_charges,
-        total=total
+        total=statement["amount"] + additional_charges
     )
 
-from flask import send_file
+
+def run_billing(period):
+    """Statements for a closed period: generated (with both ledgers and all HTML
+    receipts) by whichever worker gets there first, read from the cache after."""
+    with billing_cache.lock:
+        statements = billing_cache.load(period)
+        if statements is None:
+            store.catch_up()
+            statements = build_statements(rollups, MODELS, period)
+            billing_cache.save(period, statements, render_receipt=render_statement)
+    return statements
+
+
+def billing_statements(period=None):
+    # Closed periods can no longer change, so they are generated once
+    if period and is_closed(period):
+        return run_billing(period)
+    store.catch_up()
+    return build_statements(rollups, MODELS, period)
+
+
+def bill_previous_month():
+    last_month = datetime.utcnow().date().replace(day=1) - timedelta(days=1)
+    with app.app_context():
+        run_billing(last_month.strftime("%Y-%m"))
+
+
+scheduler.add_job(bill_previous_month, 'cron', day=1, hour=0, minute=30, timezone='UTC',
+                  misfire_grace_time=None, coalesce=True)
+
+
+@app.route("/receipt/<username>")
+def receipt(username):
+    if session.get("username") not in (username, "admin"):
+        return redirect(url_for("login"))
+    period = request.args.get("period")
+    try:
+        if period and is_closed(period):
+            # Closed periods are billed by the monthly job or an admin; users only read them
+            if session["username"] != "admin" and billing_cache.load(period) is None:
+                return f"Statements for {period} have not been generated yet", 404
+            statements = run_billing(period)
+            if os.path.exists(billing_cache.receipt_path(period, username)):
+                return send_file(billing_cache.receipt_path(period, username))
+        else:
+            statements = billing_statements(period)
+    except ValueError as e:
+        return str(e), 400
+
+    statement = next((s for s in statements if s["username"] == username),
+                     {"username": username, "items": [], "amount": 0.0})
+    return render_statement(statement)
+
+
+@app.route("/admin/billing/<period>")
+def billing_summary(period):
+    if session.get('username') != 'admin':
+        return jsonify({"error": "Forbidden"}), 403
+    try:
+        statements = billing_statements(period)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "period": period,
+        "closed": is_closed(period),
+        "contributors": len(statements),
+        "total": round(sum(s["amount"] for s in statements), 2),
+        "statements": statements
+    })
+
+
+@app.route("/admin/billing/<period>/ledger.<fmt>")
+def billing_ledger(period, fmt):
+    if session.get('username') != 'admin':
+        return jsonify({"error": "Forbidden"}), 403
+    if fmt not in ("csv", "jsonl"):
+        return jsonify({"error": "Ledger format must be csv or jsonl"}), 404
+    try:
+        if is_closed(period):
+            run_billing(period)
+            return send_file(billing_cache.path(period, f"ledger.{fmt}"), as_attachment=True,
+                             download_name=f"ledger_{period}.{fmt}")
+        statements = billing_statements(period)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Open periods reflect submissions so far, so they are built per request and never cached
+    return Response(ledger_text(list(ledger_rows(statements)), fmt),
+                    mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+                    headers={"Content-Disposition": f"attachment; filename=ledger_{period}.{fmt}"})
+
 
 @app.route('/download/<model>')
 def download_model(model):
-    filepath = os.path.join(OUTPUT_DIR, f"output_{model}.jsonl")
-    if not os.path.exists(filepath):
+    if model not in MODELS:
         return f"No output found for model: {model}", 404
-    return send_file(filepath, as_attachment=True)
+    since = request.args.get('since')  # optional ISO timestamp lower bound
+    with store.locked():
+        # Bring the export up to date with submissions since the last checkpoint
+        store.export_outputs(OUTPUT_DIR)
+        if not outputs.exists(model):
+            return f"No output found for model: {model}", 404
+        lines = outputs.reader(model, since)
+    # Archived blocks are decompressed as they stream, so the client always
+    # gets plain JSONL covering both tiers
+    return Response(chunked(lines), mimetype='application/x-ndjson', headers={
+        "Content-Disposition": f"attachment; filename=output_{model}.jsonl"
+    })
 
 
 
@@ -484,7 +926,7 @@ def list_downloads():
     files = []
 
     for folder in allowed_dirs:
-        dir_path = os.path.join("/var/data", folder)
+        dir_path = os.path.join(PERSIST_DIR, folder)
         if os.path.isdir(dir_path):
             for file in os.listdir(dir_path):
                 files.append({"folder": folder, "name": file})
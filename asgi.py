@@ -0,0 +1,21 @@
+"""ASGI entry point for the portal.
+
+Serve with ``gunicorn asgi:app -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:$PORT``.
+(Plain ``uvicorn --workers N`` hands its listening socket to the workers in
+a way that loses TCP_NODELAY, which adds ~40 ms to every keep-alive request.)
+The Flask app is unchanged; a2wsgi runs every request on a bounded thread
+pool so slow file scans in the dashboards never stall the event loop, and
+get_next threads waiting on the per-model claim dispatcher in app.py, which
+coalesces concurrent claims into one batched write, don't block other requests.
+Request bodies are streamed to Flask as it reads them, so large corpus
+uploads are never held in memory whole.
+"""
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from app import app as flask_app
+
+MAX_THREADS = int(os.environ.get('ASGI_MAX_THREADS', '16'))
+
+app = WSGIMiddleware(flask_app, workers=MAX_THREADS)
@@ -0,0 +1,175 @@
+"""Concurrent-annotator throughput: sync gunicorn workers vs the ASGI entry point.
+
+Each server is started against a throwaway PERSIST_DIR seeded with the sample
+corpus. N annotators log in and loop on get_next + submit for a fixed time
+while --admins admin clients loop on the slow pages (the hourly activity
+dashboard and output downloads). Requests/s and p50/p95 latency are reported
+per mode and per endpoint; the annotator rows show how much the admin load
+holds up get_next and submit. --admins 0 measures get_next/submit alone.
+
+    python benchmarks/bench_get_next.py --clients 16 --admins 2 --seconds 15
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CORPUS = os.path.join(ROOT, 'inputs', 'arxiv_2000_2025_all_final.jsonl')
+
+MODES = {
+    'sync': ['gunicorn', 'app:app', '--workers', '{workers}', '--bind', '127.0.0.1:{port}'],
+    'asgi': ['gunicorn', 'asgi:app', '-k', 'uvicorn_worker.UvicornWorker', '--workers', '{workers}',
+             '--bind', '127.0.0.1:{port}'],
+}
+ENDPOINTS = ('get_next', 'submit', 'dashboard', 'download')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(base, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base + '/', timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server at {base} did not start')
+
+
+def start_server(mode, workers, workdir):
+    persist = os.path.join(workdir, 'data')
+    os.makedirs(os.path.join(persist, 'inputs'), exist_ok=True)
+    shutil.copy(CORPUS, os.path.join(persist, 'inputs'))
+    port = free_port()
+    cmd = [part.format(workers=workers, port=port) for part in MODES[mode]]
+    # Annotators here loop far faster than real ones, so disable rate limiting
+    env = dict(os.environ, PERSIST_DIR=persist, PYTHONPATH=ROOT, RATE_LIMITING='0',
+               RATE_LIMIT_DB=os.path.join(workdir, 'ratelimit.sqlite'))
+    # users.json is resolved relative to the cwd, so keep it in the sandbox too
+    proc = subprocess.Popen(cmd, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    wait_until_up(base)
+    return proc, base
+
+
+def login(base, name, password='pw'):
+    http = requests.Session()
+    if name != 'admin':
+        http.post(base + '/register', data={
+            'username': name, 'password': password, 'confirm_password': password,
+            'email': f'{name}@example.com', 'phone': '0'
+        })
+    http.post(base + '/login', data={'username': name, 'password': password})
+    return http
+
+
+RESPONSE = ' '.join(['word'] * 60) + '.'
+
+
+def timed(stats, name, call):
+    t0 = time.perf_counter()
+    try:
+        r = call()
+        r.raise_for_status()
+    except requests.RequestException:
+        stats[name]['errors'] += 1
+        return None
+    stats[name]['latencies'].append(time.perf_counter() - t0)
+    return r
+
+
+def annotator(http, base, model, stop_at, stats):
+    while time.time() < stop_at:
+        r = timed(stats, 'get_next', lambda: http.get(f'{base}/get_next/{model}', timeout=30))
+        if r is None or r.json().get('id') is None:
+            continue
+        task = r.json()
+        timed(stats, 'submit', lambda: http.post(f'{base}/submit/{model}', timeout=30, json={
+            'id': task['id'], 'title': task['title'], 'response': RESPONSE
+        }))
+
+
+def admin(http, base, model, stop_at, stats):
+    # A year of activity is the widest dashboard view
+    start = time.strftime('%Y-%m-%d', time.gmtime(time.time() - 365 * 86400))
+    while time.time() < stop_at:
+        timed(stats, 'dashboard', lambda: http.get(
+            f'{base}/admin_dashboard?granularity=hour&start={start}', timeout=60))
+        timed(stats, 'download', lambda: http.get(f'{base}/download/{model}', timeout=60))
+
+
+def run(mode, args):
+    workdir = tempfile.mkdtemp(prefix=f'bench-{mode}-')
+    proc, base = start_server(mode, args.workers, workdir)
+    try:
+        sessions = [login(base, f'bench{i}') for i in range(args.clients)]
+        admins = [login(base, 'admin', 'testgptmodels') for _ in range(args.admins)]
+        stats = {name: {'latencies': [], 'errors': 0} for name in ENDPOINTS}
+        stop_at = time.time() + args.seconds
+        threads = [
+            threading.Thread(target=annotator, args=(http, base, args.model, stop_at, stats))
+            for http in sessions
+        ] + [
+            threading.Thread(target=admin, args=(http, base, args.model, stop_at, stats))
+            for http in admins
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = []
+    for name in ENDPOINTS:
+        latencies = sorted(stats[name]['latencies'])
+        if not latencies and not stats[name]['errors']:
+            continue
+        results.append({
+            'mode': mode,
+            'endpoint': name,
+            'requests': len(latencies),
+            'errors': stats[name]['errors'],
+            'rps': len(latencies) / args.seconds,
+            'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+            'p95_ms': latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000 if latencies else 0,
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--admins', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--model', default='claude')
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    args = parser.parse_args()
+
+    print(f'{"mode":<6} {"endpoint":<10} {"requests":>9} {"errors":>7} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8}')
+    for mode in args.modes:
+        for r in run(mode, args):
+            print(f'{r["mode"]:<6} {r["endpoint"]:<10} {r["requests"]:>9} {r["errors"]:>7} {r["rps"]:>8.1f} '
+                  f'{r["p50_ms"]:>8.1f} {r["p95_ms"]:>8.1f}')
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import calendar, csv, io, json, os, re
+from urllib.parse import quote
+from datetime import date, datetime
+from filelock import FileLock
+from storage import write_atomic
+
+# === Billing ===
+# Statements for every contributor in a billing period (a calendar month,
+# "YYYY-MM", in UTC) come from one pass over the period's daily activity
+# rollups, so month-end payouts cost O(days x contributors) rather than one
+# scan of every submission per receipt. Closed periods never change and are
+# cached on disk together with their CSV/JSONL ledgers and HTML receipts;
+# open periods are always rebuilt in memory and never cached.
+PRICE_PER_SUBMISSION = 0.10
+LEDGER_FIELDS = ["period", "username", "model", "quantity", "price", "amount"]
+
+
+def period_bounds(period):
+    if not re.fullmatch(r'\d{4}-\d{2}', period or ''):
+        raise ValueError(f"Billing period must look like YYYY-MM, got {period!r}")
+    start = date.fromisoformat(f"{period}-01")
+    if start > datetime.utcnow().date():
+        raise ValueError(f"Billing period {period} has not started yet")
+    end = start.replace(day=calendar.monthrange(start.year, start.month)[1])
+    return start, end
+
+
+def is_closed(period):
+    return period_bounds(period)[1] < datetime.utcnow().date()
+
+
+def model_label(model):
+    return model.replace('_', ' ').title()
+
+
+def build_statements(rollups, models, period=None):
+    """One statement per contributor, highest total first. period=None bills all time."""
+    if period is None:
+        contributors = rollups.top_contributors()
+    else:
+        start, end = period_bounds(period)
+        contributors = rollups.top_contributors(None, start, end, "day")
+
+    statements = []
+    for username, counts, _ in contributors:
+        items = [{
+            "model": model,
+            "description": f"{model_label(model)} Abstracts",
+            "quantity": counts[model],
+            "price": PRICE_PER_SUBMISSION,
+            "amount": round(PRICE_PER_SUBMISSION * counts[model], 2)
+        } for model in models if counts.get(model)]
+        if items:
+            statements.append({
+                "period": period or "all",
+                "username": username,
+                "items": items,
+                "amount": round(sum(item["amount"] for item in items), 2)
+            })
+    return statements
+
+
+def ledger_rows(statements):
+    for statement in statements:
+        for item in statement["items"]:
+            yield {
+                "period": statement["period"],
+                "username": statement["username"],
+                "model": item["model"],
+                "quantity": item["quantity"],
+                "price": item["price"],
+                "amount": item["amount"]
+            }
+
+
+def ledger_text(rows, fmt):
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=LEDGER_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+        return out.getvalue()
+    return ''.join(json.dumps(r) + '\n' for r in rows)
+
+
+class BillingCache:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Held while a period is generated, so workers don't bill it concurrently
+        self.lock = FileLock(os.path.join(directory, 'billing.lock'))
+
+    def period_dir(self, period):
+        return os.path.join(self.directory, period)
+
+    def path(self, period, name):
+        return os.path.join(self.period_dir(period), name)
+
+    def receipt_path(self, period, username):
+        return self.path(period, os.path.join("receipts", f"{quote(username, safe='')}.html"))
+
+    def load(self, period):
+        """Cached statements for a closed period, or None if there are none yet."""
+        path = self.path(period, "statements.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        # Anything generated before the period ended is a partial result
+        if not isinstance(cached, dict) or date.fromisoformat(cached["generated_at"][:10]) <= period_bounds(period)[1]:
+            return None
+        return cached["statements"]
+
+    def save(self, period, statements, render_receipt=None):
+        """Write statements, CSV/JSONL ledgers and (optionally) one HTML receipt per contributor."""
+        os.makedirs(self.path(period, "receipts"), exist_ok=True)
+        rows = list(ledger_rows(statements))
+        for fmt in ("csv", "jsonl"):
+            write_atomic(self.path(period, f"ledger.{fmt}"), ledger_text(rows, fmt))
+
+        if render_receipt:
+            for statement in statements:
+                write_atomic(self.receipt_path(period, statement["username"]), render_receipt(statement))
+        # statements.json goes last: its presence marks the period as complete
+        write_atomic(self.path(period, "statements.json"), json.dumps({
+            "period": period,
+            "generated_at": datetime.utcnow().isoformat(),
+            "statements": statements
+        }))
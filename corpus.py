@@ -0,0 +1,180 @@
+"""Corpus ingestion: stream a JSONL dump of titles into the prompt corpus.
+
+Titles are validated, de-duplicated (exactly and after normalisation) against
+everything already ingested, given the next stable integer id and appended to
+the corpus file. The dedup/id index lives in SQLite next to the corpus, so a
+multi-million-line dump is processed in fixed-size batches with bounded
+memory, and the running app only sees new lines appended to the file.
+
+    python corpus.py ingest arxiv_dump.jsonl.gz
+"""
+import argparse, gzip, hashlib, json, os, re, sqlite3, sys, unicodedata
+from uuid import uuid4
+from filelock import FileLock
+from tailreader import TailReader, CHUNK_BYTES
+
+BATCH_SIZE = 10000
+MIN_TITLE_CHARS = 8
+MAX_TITLE_CHARS = 500
+
+
+def normalize_title(title):
+    title = unicodedata.normalize('NFKC', title).casefold()
+    title = re.sub(r'[^\w\s]', ' ', title)
+    return ' '.join(title.split())
+
+
+def digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+
+
+def clean_title(record):
+    """Return the title ready to store, or None if the record is unusable."""
+    if not isinstance(record, dict) or not isinstance(record.get('title'), str):
+        return None
+    title = ' '.join(record['title'].split())
+    if not MIN_TITLE_CHARS <= len(title) <= MAX_TITLE_CHARS:
+        return None
+    if not re.search(r'[^\W\d_]', title):
+        return None  # no letters at all
+    return title
+
+
+class CorpusWriter:
+    def __init__(self, corpus_path, index_path=None):
+        self.corpus_path = corpus_path
+        self.index_path = index_path or os.path.join(os.path.dirname(corpus_path), 'corpus_index.sqlite')
+        self.lock = FileLock(f"{corpus_path}.lock")
+        self.db = sqlite3.connect(self.index_path)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS titles (norm BLOB PRIMARY KEY, exact BLOB NOT NULL, id INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        ''')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def meta(self, key, default=0):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def catch_up(self):
+        """Index corpus lines appended outside the pipeline (or by an ingest that
+        crashed before committing). Only bytes past the indexed offset are read."""
+        reader = TailReader(self.corpus_path, inode=self.meta('inode') or None, offset=self.meta('indexed_bytes'))
+        next_id = self.meta('next_id', 1)
+        while True:
+            rotated, lines = reader.poll(CHUNK_BYTES)
+            if rotated:
+                # The corpus was replaced wholesale; rebuild the index from scratch
+                self.db.execute('DELETE FROM titles')
+                next_id = 1
+            if not lines:
+                break
+            for _, line in lines:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                title = ' '.join(str(record.get('title', '')).split())
+                if isinstance(record.get('id'), int):
+                    next_id = max(next_id, record['id'] + 1)
+                self.db.execute('INSERT OR IGNORE INTO titles (norm, exact, id) VALUES (?, ?, ?)',
+                                (digest(normalize_title(title)), digest(title), record.get('id') or 0))
+        self.set_meta('next_id', next_id)
+        self.set_meta('indexed_bytes', reader.offset)
+        self.set_meta('inode', reader.inode or 0)
+        self.db.commit()
+
+    def ingest(self, lines, batch_size=BATCH_SIZE):
+        report = {'accepted': 0, 'duplicate': 0, 'near_duplicate': 0, 'invalid': 0}
+        batch = []
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8', errors='replace')
+            if not line.strip():
+                continue
+            batch.append(line)
+            if len(batch) >= batch_size:
+                self._ingest_batch(batch, report)
+                batch = []
+        if batch:
+            self._ingest_batch(batch, report)
+        return report
+
+    def _ingest_batch(self, batch, report):
+        with self.lock:
+            self.catch_up()
+            next_id = self.meta('next_id', 1)
+            out = []
+            for line in batch:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    record = None
+                title = clean_title(record)
+                if title is None:
+                    report['invalid'] += 1
+                    continue
+                norm, exact = digest(normalize_title(title)), digest(title)
+                seen = self.db.execute('SELECT exact FROM titles WHERE norm = ?', (norm,)).fetchone()
+                if seen:
+                    report['duplicate' if seen[0] == exact else 'near_duplicate'] += 1
+                    continue
+                self.db.execute('INSERT INTO titles (norm, exact, id) VALUES (?, ?, ?)', (norm, exact, next_id))
+                entry = {'uuid': str(uuid4()), 'id': next_id, 'source': record.get('source'), 'title': title}
+                if record.get('id') is not None:
+                    entry['source_id'] = str(record['id'])
+                out.append(json.dumps(entry) + '\n')
+                next_id += 1
+
+            if not out:
+                self.db.rollback()
+                return
+            data = ''.join(out).encode('utf-8')
+            with open(self.corpus_path, 'ab') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                size = f.tell()
+            # If we die before this commit, catch_up() re-indexes the appended lines
+            self.set_meta('next_id', next_id)
+            self.set_meta('indexed_bytes', size)
+            self.set_meta('inode', os.stat(self.corpus_path).st_ino)
+            self.db.commit()
+            report['accepted'] += len(out)
+
+
+def open_dump(path):
+    if path == '-':
+        return sys.stdin.buffer
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    ingest = sub.add_parser('ingest', help='append titles from a JSONL(.gz) dump, or - for stdin')
+    ingest.add_argument('dump')
+    ingest.add_argument('--corpus', default=os.path.join(
+        os.environ.get('PERSIST_DIR', '/var/data'), 'inputs', 'arxiv_2000_2025_all_final.jsonl'))
+    ingest.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.corpus), exist_ok=True)
+    writer = CorpusWriter(args.corpus)
+    try:
+        with open_dump(args.dump) as dump:
+            report = writer.ingest(dump, batch_size=args.batch_size)
+    finally:
+        writer.close()
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+import json, os
+from functools import lru_cache
+
+# === Prompt Template Registry ===
+# Versions are immutable once published: submissions record the version they
+# answered, so responses can be grouped by template without re-rendering.
+# "{title}" is substituted literally (not str.format) because templates embed
+# JSON braces.
+TITLE_PLACEHOLDER = "{title}"
+
+PROMPT_TEMPLATES = {
+    # Variant built by the legacy templates/app.py
+    "v0": (
+        'Prompt Template: Generate a academic abstract of 150 to 300 words on the topic "{title}". '
+        'Use a formal academic tone emphasizing clarity, objectivity, and technical accuracy. '
+        'Avoid suggestions, conversational language, and introductory framing. The response should contain all the below mention '
+        '{"model name":"<GPT model name - the name of the AI model generating the response>" , "Core_Model": "<core GPT model name -  name of the core language model used >", "Title":"<title content>", '
+        '"Abstract":"<abstract content - should match the title!>", "Keywords":"<comma-separated keywords - should match the domain of the abstract","think":"should reflect reasoning behind abstract generation","word_count":word count of abstract, "sentence_count": Sentence count of abstract, "character_count":character count of abstract, "generated_at":"Timestamp"} use valid json format.'
+    ),
+    "v1": (
+        'Prompt Template: Generate a academic abstract of 150 to 300 words on the topic "{title}". '
+        'Use a formal academic tone emphasizing clarity, objectivity, and technical accuracy. '
+        'Avoid suggestions, conversational language, and introductory framing. The response should contain all the below mention '
+        '{"model name":"<GPT model name - the name of the AI model generating the response>", '
+        '"Core_Model":"<core GPT model name - name of the core language model used>", '
+        '"Title":"<title content>", '
+        '"Abstract":"<abstract content - should match the title!>", '
+        '"Keywords":"<comma-separated keywords - should match the domain of the abstract>", '
+        '"think":"should reflect reasoning behind abstract generation", '
+        '"word_count": word count of abstract, '
+        '"sentence_count": Sentence count of abstract, '
+        '"character_count": character count of abstract, '
+        '"generated_at":"Timestamp"} '
+        'Use valid JSON format.'
+    ),
+}
+DEFAULT_TEMPLATE = "v1"
+MODEL_TEMPLATES = {}  # model -> version, for models that need their own wording
+
+
+def load_templates(path):
+    """Merge an optional JSON config of the form
+    {"templates": {version: text}, "default": version, "models": {model: version}}."""
+    global DEFAULT_TEMPLATE
+    if not os.path.exists(path):
+        return
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+
+    for version, text in config.get("templates", {}).items():
+        if TITLE_PLACEHOLDER not in text:
+            raise ValueError(f"Prompt template {version} has no {TITLE_PLACEHOLDER} placeholder")
+        if PROMPT_TEMPLATES.get(version, text) != text:
+            raise ValueError(f"Prompt template {version} is already published with different text")
+        PROMPT_TEMPLATES[version] = text
+
+    for version in [config.get("default", DEFAULT_TEMPLATE), *config.get("models", {}).values()]:
+        if version not in PROMPT_TEMPLATES:
+            raise ValueError(f"Unknown prompt template version: {version}")
+    DEFAULT_TEMPLATE = config.get("default", DEFAULT_TEMPLATE)
+    MODEL_TEMPLATES.update(config.get("models", {}))
+    render_prompt.cache_clear()
+
+
+def template_for(model):
+    return MODEL_TEMPLATES.get(model, DEFAULT_TEMPLATE)
+
+
+@lru_cache(maxsize=4096)
+def render_prompt(version, prompt_id, title):
+    # prompt_id is part of the cache key; titles are fixed per id
+    return PROMPT_TEMPLATES[version].replace(TITLE_PLACEHOLDER, title)
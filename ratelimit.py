@@ -0,0 +1,57 @@
+import math, os, sqlite3, tempfile, threading, time
+
+# === Rate Limiting ===
+# Token buckets shared by every gunicorn worker on the host. State lives in a
+# SQLite file on tmpfs (/dev/shm), so checking a bucket never waits on the
+# persistent disk; each check-and-take is one short IMMEDIATE transaction.
+
+
+def default_path():
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'college_abstract_portal_ratelimit.sqlite')
+
+
+class RateLimiter:
+    def __init__(self, path=None):
+        self.path = path or default_path()
+        self.local = threading.local()
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    def _db(self):
+        # sqlite3 connections are per thread; workers open their own after fork
+        db = getattr(self.local, 'db', None)
+        if db is None or self.local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            db.execute('PRAGMA synchronous=OFF')
+            self.local.db, self.local.pid = db, os.getpid()
+        return db
+
+    def take(self, *buckets):
+        """Take one token from every (key, capacity, per_second) bucket, or from
+        none of them. Returns 0 when allowed, else seconds until a retry can pass."""
+        db = self._db()
+        now = time.time()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            levels = []
+            wait = 0.0
+            for key, capacity, per_second in buckets:
+                row = db.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * per_second)
+                if tokens < 1:
+                    wait = max(wait, (1 - tokens) / per_second)
+                levels.append((key, tokens))
+            if wait == 0:
+                db.executemany('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                               [(key, tokens - 1, now) for key, tokens in levels])
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        return wait
+
+
+def retry_after(seconds):
+    return str(max(1, math.ceil(seconds)))
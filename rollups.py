@@ -0,0 +1,81 @@
+import heapq
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+# === Activity Rollups ===
+# Submission counts per (username, model) in hourly, daily and weekly buckets,
+# updated as submissions are applied to the store. A query over any range
+# walks only the buckets in it, never the submissions themselves. Bucket keys
+# are UTC, matching the submission timestamps: "YYYY-MM-DDTHH" for hours,
+# "YYYY-MM-DD" for days and the Monday's date for weeks.
+GRANULARITIES = ("hour", "day", "week")
+
+
+@lru_cache(maxsize=4096)
+def week_of(day):
+    d = date.fromisoformat(day)
+    return (d - timedelta(days=d.weekday())).isoformat()
+
+
+def bucket_keys(start, end, granularity):
+    """Bucket keys covering the dates start..end (inclusive), in order."""
+    # Count steps rather than stepping past `end`, which overflows at date.max
+    if granularity == "hour":
+        t = datetime.combine(start, datetime.min.time())
+        for i in range(((end - start).days + 1) * 24):
+            yield (t + timedelta(hours=i)).strftime("%Y-%m-%dT%H")
+    elif granularity == "day":
+        for i in range((end - start).days + 1):
+            yield (start + timedelta(days=i)).isoformat()
+    elif granularity == "week":
+        monday = date.fromisoformat(week_of(start.isoformat()))
+        for i in range((end - monday).days // 7 + 1):
+            yield (monday + timedelta(weeks=i)).isoformat()
+    else:
+        raise ValueError(f"Unknown granularity: {granularity}")
+
+
+class ActivityRollups:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.buckets = {g: defaultdict(lambda: defaultdict(int)) for g in GRANULARITIES}
+        self.totals = defaultdict(lambda: defaultdict(int))  # username -> model -> count
+
+    def feed(self, row, seq=None):
+        timestamp = row.get("timestamp")
+        key = (row.get("username", "unknown"), row["model"])
+        self.totals[key[0]][key[1]] += 1
+        if not timestamp:
+            return
+        day = timestamp[:10]
+        self.buckets["hour"][timestamp[:13]][key] += 1
+        self.buckets["day"][day][key] += 1
+        self.buckets["week"][week_of(day)][key] += 1
+
+    def activity(self, start, end, granularity="day"):
+        """(labels, {username: [count per bucket]}) for the range."""
+        labels = list(bucket_keys(start, end, granularity))
+        series = defaultdict(lambda: [0] * len(labels))
+        table = self.buckets[granularity]
+        for i, label in enumerate(labels):
+            if label in table:
+                for (username, _), count in table[label].items():
+                    series[username][i] += count
+        return labels, dict(series)
+
+    def top_contributors(self, n=None, start=None, end=None, granularity="day"):
+        """Per-user counts by model, highest total first; all time unless a range is given."""
+        if start is None:
+            per_user = {u: dict(models) for u, models in self.totals.items()}
+        else:
+            per_user = defaultdict(lambda: defaultdict(int))
+            table = self.buckets[granularity]
+            for label in bucket_keys(start, end, granularity):
+                for (username, model), count in table.get(label, {}).items():
+                    per_user[username][model] += count
+        ranked = [(sum(models.values()), username, models) for username, models in per_user.items()]
+        ranked = heapq.nlargest(n, ranked) if n else sorted(ranked, reverse=True)
+        return [(username, dict(models), total) for total, username, models in ranked]
@@ -0,0 +1,366 @@
+import json, os, threading
+from contextlib import contextmanager
+from filelock import FileLock
+from tailreader import TailReader
+
+# === Embedded Store ===
+# State is kept in memory as typed tables and made durable by a write-ahead
+# log: every change is one JSON line appended (and fsynced) to wal.jsonl.
+# checkpoint() writes the tables to snapshot.json and starts a fresh WAL, so
+# startup only replays the records written since the last checkpoint.
+# Gunicorn workers share the files: writes happen under a FileLock, and each
+# process catches up on records appended by the others before it reads.
+# Response text lives only in the WAL and in the outputs/ JSONL exports.
+
+
+class Table:
+    def __init__(self, name, key, fields, indexes=()):
+        self.name = name
+        self.key = key  # field name, or tuple of field names joined with ':'
+        self.fields = fields  # field -> type or tuple of types
+        self.indexes = indexes  # fields whose values group rows, e.g. model
+        self.rows = {}
+        self.groups = {field: {} for field in indexes}
+
+    def row_key(self, row):
+        if isinstance(self.key, tuple):
+            return ":".join(str(row[k]) for k in self.key)
+        return row[self.key]
+
+    def check(self, row):
+        typed = {}
+        for field, kind in self.fields.items():
+            value = row.get(field)
+            if not isinstance(value, kind):
+                raise TypeError(f"{self.name}.{field} must be {kind}, got {value!r}")
+            typed[field] = value
+        return typed
+
+    def put(self, row):
+        row = self.check(row)
+        key = self.row_key(row)
+        old = self.rows.get(key)
+        for field in self.indexes:
+            if old is not None:
+                self.groups[field][old[field]].pop(key, None)
+            self.groups[field].setdefault(row[field], {})[key] = row
+        self.rows[key] = row
+        return row
+
+    def get(self, key):
+        return self.rows.get(key)
+
+    def delete(self, key):
+        row = self.rows.pop(key, None)
+        if row is not None:
+            for field in self.indexes:
+                self.groups[field][row[field]].pop(key, None)
+
+    def where(self, field, value):
+        return list(self.groups[field].get(value, {}).values())
+
+    def clear(self):
+        self.rows = {}
+        self.groups = {field: {} for field in self.indexes}
+
+    def __iter__(self):
+        return iter(list(self.rows.values()))
+
+    def __len__(self):
+        return len(self.rows)
+
+
+OPTIONAL_STR = (str, type(None))
+OPTIONAL_INT = (int, type(None))
+
+
+class Store:
+    def __init__(self, directory, seed=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.snapshot_path = os.path.join(directory, 'snapshot.json')
+        self.wal_path = os.path.join(directory, 'wal.jsonl')
+        self.lock = FileLock(os.path.join(directory, 'store.lock'))
+        self.mutex = threading.RLock()
+        self.waiting_writers = 0  # writes in this process queued behind the lock
+        self.gauge_lock = threading.Lock()
+
+        self.users = Table('users', 'username', {
+            'username': str, 'password': str, 'email': str, 'phone': str,
+        })
+        self.assignments = Table('assignments', ('model', 'id'), {
+            'model': str, 'id': str, 'username': str, 'assigned_at': int,
+            'submitted': bool, 'worker': OPTIONAL_INT, 'template_version': OPTIONAL_STR,
+        }, indexes=('model', 'username'))
+        self.submissions = Table('submissions', 'uuid', {
+            'uuid': str, 'id': str, 'title': str, 'model': str, 'username': str,
+            'word_count': int, 'sentence_count': int, 'character_count': int,
+            'template_version': OPTIONAL_STR, 'timestamp': str,
+        }, indexes=('model',))
+        self.tables = {t.name: t for t in (self.users, self.assignments, self.submissions)}
+
+        self.seq = 0
+        self.consumers = []  # derived views fed every submission; see subscribe()
+        self.wal = TailReader(self.wal_path)
+        with self.mutex, self.lock:
+            self._load()
+            # Seeding happens under the lock, so when several workers start on
+            # a fresh store exactly one seeds it and the rest load the result
+            if seed is not None and self.is_empty():
+                self._seed(*seed())
+
+    # --- Loading and replay ---
+    def _load(self):
+        for table in self.tables.values():
+            table.clear()
+        for consumer in self.consumers:
+            consumer.reset()
+        self.seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self.seq = snapshot['seq']
+            for name, rows in snapshot['tables'].items():
+                for row in rows:
+                    self.tables[name].put(row)
+            for row in self.submissions:
+                for consumer in self.consumers:
+                    consumer.feed(row, self.seq)
+        if not os.path.exists(self.wal_path):
+            open(self.wal_path, 'a').close()
+        self.wal = TailReader(self.wal_path)
+        self._replay(self.wal.poll()[1])
+
+    def _replay(self, lines):
+        for i, (offset, line) in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if i == len(lines) - 1:
+                    # Torn final record; the next write truncates it
+                    self.wal.offset = offset
+                    break
+                raise
+            if record['seq'] > self.seq:
+                self._apply(record)
+                self.seq = record['seq']
+
+    def catch_up(self):
+        with self.mutex:
+            rotated, lines = self.wal.poll()
+            if rotated:
+                # Another worker checkpointed and started a new WAL
+                self._load()
+            else:
+                self._replay(lines)
+
+    def _apply(self, record):
+        op = record['op']
+        if op == 'user':
+            self.users.put(record['row'])
+        elif op == 'lease':
+            for row in record['rows']:
+                current = self.assignments.get(f"{row['model']}:{row['id']}")
+                if current is None or not current['submitted']:
+                    self.assignments.put(row)
+        elif op == 'submit':
+            row = self.submissions.put(record['row'])
+            for consumer in self.consumers:
+                consumer.feed(row, record['seq'])
+            lease = self.assignments.get(f"{row['model']}:{row['id']}")
+            self.assignments.put({
+                'model': row['model'], 'id': row['id'], 'username': row['username'],
+                'assigned_at': lease['assigned_at'] if lease else 0, 'submitted': True,
+                'template_version': row.get('template_version'),
+            })
+        elif op == 'expire':
+            for row in self.assignments:
+                if not row['submitted'] and row['assigned_at'] < record['before']:
+                    self.assignments.delete(self.assignments.row_key(row))
+        else:
+            raise ValueError(f"Unknown WAL op: {op}")
+
+    def subscribe(self, consumer):
+        """Keep a derived view (reset() / feed(submission, seq)) in step with the
+        submissions table, including reloads after another worker's checkpoint."""
+        with self.mutex:
+            consumer.reset()
+            for row in self.submissions:
+                consumer.feed(row, self.seq)
+            self.consumers.append(consumer)
+
+    # --- Writes ---
+    @contextmanager
+    def locked(self):
+        """Hold the store exclusively across workers, caught up to the latest WAL."""
+        with self.mutex, self.lock:
+            self.catch_up()
+            yield self
+
+    def write(self, record):
+        with self.gauge_lock:
+            self.waiting_writers += 1
+        try:
+            self._write(record)
+        finally:
+            with self.gauge_lock:
+                self.waiting_writers -= 1
+
+    def _write(self, record):
+        with self.locked():
+            if os.path.getsize(self.wal_path) > self.wal.offset:
+                # Torn record from a writer that crashed mid-append
+                os.truncate(self.wal_path, self.wal.offset)
+            record = dict(record, seq=self.seq + 1)
+            line = (json.dumps(record) + '\n').encode('utf-8')
+            # Applying first validates the rows before anything reaches the WAL
+            self._apply(record)
+            try:
+                fd = os.open(self.wal_path, os.O_WRONLY | os.O_APPEND)
+                try:
+                    os.write(fd, line)
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError:
+                self._load()
+                raise
+            self.seq = record['seq']
+            self.wal.offset += len(line)
+
+    def add_user(self, row):
+        with self.locked():
+            if self.users.get(row['username']) is not None:
+                return False
+            self.write({'op': 'user', 'row': row})
+            return True
+
+    def get_lease(self, model, prompt_id):
+        self.catch_up()
+        return self.assignments.get(f"{model}:{prompt_id}")
+
+    def get_user(self, username):
+        self.catch_up()
+        return self.users.get(username)
+
+    def lease(self, rows):
+        if rows:
+            self.write({'op': 'lease', 'rows': rows})
+
+    def submit(self, row):
+        self.write({'op': 'submit', 'row': row})
+
+    def expire(self, before):
+        with self.locked():
+            if any(not r['submitted'] and r['assigned_at'] < before for r in self.assignments):
+                self.write({'op': 'expire', 'before': before})
+
+    # --- Reads ---
+    def model_submissions(self, model):
+        self.catch_up()
+        return self.submissions.where('model', model)
+
+    def all_submissions(self):
+        self.catch_up()
+        return list(self.submissions)
+
+    # --- Checkpoint and exports ---
+    def pending_submissions(self, model=None):
+        """Full submission rows (with response text) written since the last checkpoint."""
+        with open(self.wal_path, 'rb') as f:
+            for line in f.read()[:self.wal.offset].splitlines():
+                record = json.loads(line)
+                if record['op'] == 'submit' and model in (None, record['row']['model']):
+                    yield record['row']
+
+    def export_outputs(self, output_dir):
+        """Append submissions not yet exported to outputs/output_<model>.jsonl."""
+        with self.locked():
+            by_model = {}
+            for row in self.pending_submissions():
+                by_model.setdefault(row['model'], []).append(row)
+            for model, rows in by_model.items():
+                path = os.path.join(output_dir, f"output_{model}.jsonl")
+                exported = last_uuid(path)
+                uuids = [r['uuid'] for r in rows]
+                if exported in uuids:
+                    rows = rows[uuids.index(exported) + 1:]
+                if rows:
+                    with open(path, 'a', encoding='utf-8') as f:
+                        f.write(''.join(json.dumps(r) + '\n' for r in rows))
+                        f.flush()
+                        os.fsync(f.fileno())
+
+    def export_user_logs(self, user_log_dir, models, exclude=()):
+        """Write user_logs/<model>_users.jsonl, leaving out rows held by `exclude` usernames."""
+        with self.locked():
+            for model in models:
+                rows = sorted((r for r in self.assignments.where('model', model) if r['username'] not in exclude),
+                              key=lambda r: r['assigned_at'])
+                write_atomic(os.path.join(user_log_dir, f"{model}_users.jsonl"),
+                             ''.join(json.dumps(r) + '\n' for r in rows))
+
+    def export_users(self, users_file):
+        with self.locked():
+            users = {r['username']: {k: v for k, v in r.items() if k != 'username'} for r in self.users}
+            write_atomic(users_file, json.dumps(users, indent=2))
+
+    def checkpoint(self, output_dir):
+        """Fold the WAL into a new snapshot. Returns False, doing nothing, when
+        there have been no writes since the last checkpoint."""
+        with self.locked():
+            if self.wal.offset == 0:
+                return False
+            # Response text only lives in the WAL, so export it before the WAL goes
+            self.export_outputs(output_dir)
+            snapshot = {'seq': self.seq, 'tables': {n: list(t) for n, t in self.tables.items()}}
+            write_atomic(self.snapshot_path, json.dumps(snapshot))
+            write_atomic(self.wal_path, '')
+            self.wal = TailReader(self.wal_path)
+            self.wal.poll()
+            return True
+
+    def is_empty(self):
+        return self.seq == 0 and not os.path.exists(self.snapshot_path)
+
+    def _seed(self, users, assignments, submissions):
+        """Fill an empty store from pre-existing data and snapshot it straight
+        away. Caller must hold the lock."""
+        for row in users:
+            self.users.put(row)
+        for row in assignments:
+            self.assignments.put(row)
+        for row in submissions:
+            self.submissions.put(row)
+        write_atomic(self.snapshot_path, json.dumps(
+            {'seq': self.seq, 'tables': {n: list(t) for n, t in self.tables.items()}}))
+
+
+def write_atomic(path, text):
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def last_uuid(path):
+    """uuid of the last complete record in a JSONL file, read from the tail."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        chunk = 4096
+        while True:
+            start = max(0, size - chunk)
+            f.seek(start)
+            lines = f.read(size - start).splitlines()
+            if len(lines) > 1 or start == 0:
+                break
+            chunk *= 2
+    for line in reversed(lines):
+        if line.strip():
+            return json.loads(line).get('uuid')
+    return None
@@ -0,0 +1,89 @@
+import json, os
+
+# === Tail-follow Reader ===
+# Our JSONL files only grow between compactions, so readers remember the
+# (inode, byte offset) they stopped at and read just the newly appended lines.
+# A new inode (file replaced) or a size below the offset (truncated) means the
+# file was rotated; reading then restarts at byte 0 and consumers reset.
+
+
+CHUNK_BYTES = 1 << 20
+
+
+class TailReader:
+    def __init__(self, path, inode=None, offset=0):
+        self.path = path
+        self.inode = inode
+        self.offset = offset
+
+    def state(self):
+        return {"inode": self.inode, "offset": self.offset}
+
+    def poll(self, max_bytes=None):
+        """Return (rotated, lines): complete lines appended since the last poll as
+        (offset, bytes) pairs. A trailing line without its newline is left for
+        the next poll. With max_bytes, roughly that much is read per call (always
+        at least one whole line); call again until no lines come back."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            rotated = self.inode is not None
+            self.inode, self.offset = None, 0
+            return rotated, []
+
+        rotated = self.inode is not None and (st.st_ino != self.inode or st.st_size < self.offset)
+        if rotated or self.inode is None:
+            self.inode, self.offset = st.st_ino, 0
+        if st.st_size == self.offset:
+            return rotated, []
+
+        with open(self.path, 'rb') as f:
+            # Re-check on the open handle in case the file was swapped after stat
+            if os.fstat(f.fileno()).st_ino != self.inode:
+                self.inode, self.offset, rotated = os.fstat(f.fileno()).st_ino, 0, True
+            f.seek(self.offset)
+            if max_bytes is None:
+                data = f.read()
+            else:
+                data = f.read(max_bytes)
+                while data and b'\n' not in data:
+                    more = f.read(max_bytes)
+                    if not more:
+                        break
+                    data += more
+
+        lines = []
+        end = data.rfind(b'\n') + 1
+        position = self.offset
+        for line in data[:end].splitlines(keepends=True):
+            lines.append((position, line))
+            position += len(line)
+        self.offset = position
+        return rotated, lines
+
+
+class JsonlFollower:
+    """Feed the records appended to a JSONL file to incremental consumers.
+
+    Consumers implement reset() and feed(record, offset)."""
+
+    def __init__(self, path, *consumers):
+        self.reader = TailReader(path)
+        self.consumers = consumers
+
+    def refresh(self, chunk_bytes=CHUNK_BYTES):
+        count = 0
+        while True:
+            rotated, lines = self.reader.poll(chunk_bytes)
+            if rotated:
+                for consumer in self.consumers:
+                    consumer.reset()
+            if not lines:
+                return count
+            for offset, line in lines:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                for consumer in self.consumers:
+                    consumer.feed(record, offset)
+            count += len(lines)
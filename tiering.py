@@ -0,0 +1,185 @@
+import gzip, itertools, json, os
+from storage import write_atomic
+
+# === Output Tiering ===
+# outputs/output_<model>.jsonl stays the hot tier: recent records, plain JSONL.
+# Older records move to output_<model>.archive.jsonl.gz, made of independent
+# gzip members of BLOCK_RECORDS lines each. The concatenation is still a valid
+# .gz file, and the .idx.json sidecar lists every block's byte offset, length
+# and timestamp range, so a reader can seek straight to the blocks it needs.
+BLOCK_RECORDS = 1000
+HOT_DAYS = 7
+MIN_ARCHIVE_RECORDS = 1000  # don't write tiny blocks on every checkpoint
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def record_meta(line):
+    record = json.loads(line)
+    return record.get("uuid"), record.get("timestamp") or ""
+
+
+class BlockArchive:
+    def __init__(self, path):
+        self.path = path
+        self.index_path = f"{path}.idx.json"
+        self.index = {"blocks": [], "last_uuid": None}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+
+    @property
+    def size(self):
+        blocks = self.index["blocks"]
+        return blocks[-1]["offset"] + blocks[-1]["length"] if blocks else 0
+
+    def records(self):
+        return sum(b["records"] for b in self.index["blocks"])
+
+    def write_blocks(self, batches):
+        """Append one gzip member per batch of lines, then publish them in the index.
+        Bytes past the indexed size are left over from an interrupted run."""
+        if os.path.exists(self.path) and os.path.getsize(self.path) > self.size:
+            os.truncate(self.path, self.size)
+        blocks = list(self.index["blocks"])
+        last_uuid = self.index["last_uuid"]
+        with open(self.path, 'ab') as f:
+            for lines in batches:
+                data = gzip.compress(b''.join(lines), mtime=0)
+                first_uuid, first_ts = record_meta(lines[0])
+                last_uuid, last_ts = record_meta(lines[-1])
+                blocks.append({"offset": f.tell(), "length": len(data), "records": len(lines),
+                               "first_ts": first_ts, "last_ts": last_ts})
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self.index = {"blocks": blocks, "last_uuid": last_uuid}
+        write_atomic(self.index_path, json.dumps(self.index))
+
+    def iter_lines(self, since=None):
+        """Archived lines in order, skipping whole blocks that end before `since`."""
+        if not self.index["blocks"]:
+            return
+        with open(self.path, 'rb') as f:
+            for block in self.index["blocks"]:
+                if since and block["last_ts"] and block["last_ts"] < since:
+                    continue
+                f.seek(block["offset"])
+                yield from gzip.decompress(f.read(block["length"])).splitlines(keepends=True)
+
+
+class TieredOutputs:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def hot_path(self, model):
+        return os.path.join(self.output_dir, f"output_{model}.jsonl")
+
+    def archive(self, model):
+        return BlockArchive(os.path.join(self.output_dir, f"output_{model}.archive.jsonl.gz"))
+
+    def exists(self, model):
+        return os.path.exists(self.hot_path(model)) or self.archive(model).index["blocks"] != []
+
+    def reader(self, model, since=None):
+        """Every output line for a model (archive first, in write order), or only
+        those stamped at or after `since`. The archive index and hot file are
+        pinned here, so call this under the lock that guards exports and
+        demotion; iterating the result can happen after releasing it."""
+        archive = self.archive(model)
+        hot = open(self.hot_path(model), 'rb') if os.path.exists(self.hot_path(model)) else None
+        return self._lines(archive, hot, since)
+
+    def _lines(self, archive, hot, since):
+        lines = archive.iter_lines(since)
+        if hot is not None:
+            lines = itertools.chain(lines, closing_lines(hot))
+        for line in lines:
+            if since and record_meta(line)[1] < since:
+                continue
+            yield line
+
+    def iter_records(self, model, since=None):
+        for line in self.reader(model, since):
+            if line.strip():
+                yield json.loads(line)
+
+    def demote(self, model, cutoff, min_records=MIN_ARCHIVE_RECORDS):
+        """Move the leading hot records stamped before `cutoff` (ISO string) into
+        the archive. Caller must hold the lock that guards output exports."""
+        return demote_file(self.hot_path(model), self.archive(model), cutoff, min_records)
+
+
+def chunked(lines, size=STREAM_CHUNK_BYTES):
+    """Join lines into ~size-byte chunks so streaming responses aren't one write per record."""
+    buffer, buffered = [], 0
+    for line in lines:
+        buffer.append(line)
+        buffered += len(line)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def closing_lines(f):
+    with f:
+        yield from f
+
+
+def demote_file(hot_path, archive, cutoff, min_records=MIN_ARCHIVE_RECORDS):
+    if not os.path.exists(hot_path):
+        return 0
+    # Cheap check first: nothing to do unless enough leading records are cold
+    cold = 0
+    with open(hot_path, 'rb') as f:
+        for line in f:
+            if line.strip() and record_meta(line)[1] >= cutoff:
+                break
+            cold += 1
+            if cold >= min_records:
+                break
+    if cold < min_records:
+        return 0
+
+    # A run that died after writing the archive but before replacing the hot
+    # file left those records in both places; skip up to the last archived uuid
+    skip_until = archive.index["last_uuid"]
+    if skip_until:
+        with open(hot_path, 'rb') as f:
+            if not any(line.strip() and record_meta(line)[0] == skip_until for line in f):
+                skip_until = None
+
+    tmp = f"{hot_path}.tmp"
+    archived = 0
+
+    def cold_batches(src, rest):
+        nonlocal archived, skip_until
+        batch, archiving = [], True
+        for line in src:
+            if not line.strip():
+                continue
+            uuid, timestamp = record_meta(line)
+            if skip_until:
+                if uuid == skip_until:
+                    skip_until = None
+                continue
+            if archiving and timestamp < cutoff:
+                batch.append(line)
+                if len(batch) >= BLOCK_RECORDS:
+                    archived += len(batch)
+                    yield batch
+                    batch = []
+            else:
+                archiving = False
+                rest.write(line)
+        if batch:
+            archived += len(batch)
+            yield batch
+
+    with open(hot_path, 'rb') as src, open(tmp, 'wb') as rest:
+        archive.write_blocks(cold_batches(src, rest))
+        rest.flush()
+        os.fsync(rest.fileno())
+    os.replace(tmp, hot_path)
+    return archived